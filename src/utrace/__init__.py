@@ -2,52 +2,230 @@
 
 from __future__ import annotations
 
-from contextlib import contextmanager
+import sys
+from collections import defaultdict
+from contextlib import ContextDecorator, contextmanager
 from contextvars import ContextVar
 from itertools import count
 from random import random
 from secrets import token_hex
-from time import perf_counter, time
-from typing import Any, Callable, Iterator, Mapping, NotRequired, TypedDict
+from time import perf_counter_ns, time_ns
+from types import TracebackType
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Mapping
 
 from attrs import Factory, define, field
-from rich import print as rich_print
-from rich.columns import Columns
-from rich.console import Group
-from rich.text import Text
-from rich.tree import Tree
+
+if TYPE_CHECKING:
+    from rich.tree import Tree
 
 __all__ = ["Span", "Tracer", "TracerBase", "TraceId", "SpanId", "Metadata"]
 
 
-type Instant = float
-type DurationMS = float  # Milliseconds
+type InstantNS = int  # Nanoseconds since the epoch
+type DurationNS = int  # Nanoseconds
 type Metadata = dict[str, str | int]
-
-Span = TypedDict(
-    "Span",
-    {
-        "name": str,
-        "time": Instant,
-        "duration_ms": DurationMS,
-        "trace.trace_id": str,
-        "trace.span_id": str,
-        "trace.parent_id": NotRequired[str],
-        "metadata": Metadata,
-        "trace_metadata": Metadata,
-        "tracer_metadata": Metadata,
-    },
-)
-
 type TraceId = str
 type SpanId = str
 
 
+@define
+class Span:
+    """A finished span, as handed to receivers."""
+
+    name: str
+    time_ns: InstantNS
+    duration_ns: DurationNS
+    trace_id: TraceId
+    span_id: SpanId
+    metadata: Metadata
+    trace_metadata: Metadata
+    tracer_metadata: Metadata
+    parent_id: SpanId | None = None
+
+    def as_dict(self) -> dict[str, Any]:
+        """Convert into a dictionary, using the Honeycomb field names."""
+        res: dict[str, Any] = {
+            "name": self.name,
+            "time": self.time_ns / 1_000_000_000,
+            "duration_ms": self.duration_ns / 1_000_000,
+            "trace.trace_id": self.trace_id,
+            "trace.span_id": self.span_id,
+            "metadata": self.metadata,
+            "trace_metadata": self.trace_metadata,
+            "tracer_metadata": self.tracer_metadata,
+        }
+        if self.parent_id is not None:
+            res["trace.parent_id"] = self.parent_id
+        return res
+
+
 _trace_cnt = count().__next__
 _span_cnt = count().__next__
 _trace_prefix = token_hex(8)
 
 
+class _TraceCM(ContextDecorator):
+    """Records a trace and its root span, emitting the trace on exit.
+
+    Whether the trace is recorded is decided on entry, by `trace_chance`.
+    """
+
+    __slots__ = (
+        "_children",
+        "_duration_start",
+        "_metadata",
+        "_name",
+        "_span_id",
+        "_start",
+        "_token",
+        "_trace_id",
+        "_trace_metadata",
+        "_tracer",
+    )
+
+    def __init__(
+        self,
+        tracer: TracerBase,
+        name: str,
+        trace_metadata: Metadata,
+        metadata: Metadata,
+    ) -> None:
+        self._tracer = tracer
+        self._name = name
+        self._trace_metadata = trace_metadata
+        self._metadata = metadata
+
+    def _recreate_cm(self) -> _TraceCM:
+        # Decorated functions get a fresh trace for every call.
+        return _TraceCM(
+            self._tracer, self._name, self._trace_metadata, self._metadata.copy()
+        )
+
+    def __enter__(self) -> Metadata:
+        tracer = self._tracer
+        if tracer.trace_chance is not None and random() > tracer.trace_chance:
+            self._token = None
+            return self._metadata
+        self._trace_id = trace_id = tracer._trace_id_factory()
+        self._span_id = span_id = tracer._span_id_factory()
+        self._start = time_ns()
+        self._duration_start = perf_counter_ns()
+        children: list[Span] = []
+        self._children = children
+        self._token = tracer._active_trace_and_span.set(
+            (trace_id, self._trace_metadata, span_id, children)
+        )
+        return self._metadata
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        if self._token is None:
+            return
+        duration = perf_counter_ns() - self._duration_start
+        if exc_value is not None:
+            self._metadata["error"] = repr(exc_value)
+        tracer = self._tracer
+        tracer._active_trace_and_span.reset(self._token)
+        children = self._children
+        children.append(
+            Span(
+                self._name,
+                self._start,
+                duration,
+                self._trace_id,
+                self._span_id,
+                self._metadata,
+                self._trace_metadata,
+                tracer.metadata,
+            )
+        )
+        tracer._emit(children)
+
+
+class _SpanCM(ContextDecorator):
+    """Records a span into the trace of its parent.
+
+    Without an explicit parent, the active span is looked up on entry.
+    If there is none, nothing is recorded.
+    """
+
+    __slots__ = (
+        "_active_parent",
+        "_duration_start",
+        "_metadata",
+        "_name",
+        "_parent",
+        "_span_id",
+        "_start",
+        "_token",
+        "_tracer",
+    )
+
+    def __init__(
+        self,
+        tracer: TracerBase,
+        name: str,
+        parent: tuple[TraceId, Metadata, SpanId, list[Span]] | None,
+        metadata: Metadata,
+    ) -> None:
+        self._tracer = tracer
+        self._name = name
+        self._parent = parent
+        self._metadata = metadata
+
+    def _recreate_cm(self) -> _SpanCM:
+        # Decorated functions get a fresh span for every call.
+        return _SpanCM(self._tracer, self._name, self._parent, self._metadata.copy())
+
+    def __enter__(self) -> Metadata:
+        tracer = self._tracer
+        self._active_parent = parent = (
+            self._parent or tracer._active_trace_and_span.get()
+        )
+        if parent is None:
+            return self._metadata
+        trace_id, trace_metadata, _, children = parent
+        self._start = time_ns()
+        self._duration_start = perf_counter_ns()
+        self._span_id = span_id = tracer._span_id_factory()
+        self._token = tracer._active_trace_and_span.set(
+            (trace_id, trace_metadata, span_id, children)
+        )
+        return self._metadata
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        if self._active_parent is None:
+            return
+        duration = perf_counter_ns() - self._duration_start
+        if exc_value is not None:
+            self._metadata["error"] = repr(exc_value)
+        tracer = self._tracer
+        tracer._active_trace_and_span.reset(self._token)
+        trace_id, trace_metadata, parent_span_id, children = self._active_parent
+        children.append(
+            Span(
+                self._name,
+                self._start,
+                duration,
+                trace_id,
+                self._span_id,
+                self._metadata,
+                trace_metadata,
+                tracer.metadata,
+                parent_span_id,
+            )
+        )
+
+
 @define
 class TracerBase:
     """
@@ -68,95 +246,31 @@ class TracerBase:
     def __attrs_post_init__(self) -> None:
         self.metadata["service.name"] = self.service_name
 
-    @contextmanager
     def _trace(
-        self,
-        name: str,
-        trace_metadata: dict[str, str | int] = {},
-        /,
-        **kwargs: str | int,
-    ) -> Iterator[dict[str, str | int]]:
+        self, name: str, trace_metadata: Metadata, span_metadata: Metadata
+    ) -> _TraceCM:
         """Start a trace and a span, trace_chance permitting.
 
+        The span metadata dictionary is used as-is, so public wrappers can
+        hand over their `**kwargs` without copying them.
+
         Returns:
-            A dictionary that can be used to add metadata.
+            A context manager (or decorator), entering which returns a
+            dictionary that can be used to add metadata.
         """
-        if self.trace_chance is not None and random() > self.trace_chance:
-            yield {}
-            return
-        trace_id = self._trace_id_factory()
-        span_id = self._span_id_factory()
-        start = time()
-        duration_start = perf_counter()
-        span_metadata = kwargs
-        child_spans: list[Span] = []
-        token = self._active_trace_and_span.set(
-            (trace_id, trace_metadata, span_id, child_spans)
-        )
-        try:
-            yield span_metadata
-        except BaseException as exc:
-            span_metadata["error"] = repr(exc)
-            raise
-        finally:
-            self._active_trace_and_span.reset(token)
-            duration = perf_counter() - duration_start
-            child_spans.append(
-                {
-                    "name": name,
-                    "time": start,
-                    "duration_ms": duration * 1000,
-                    "trace.trace_id": trace_id,
-                    "trace.span_id": span_id,
-                    "metadata": span_metadata,
-                    "trace_metadata": trace_metadata,
-                    "tracer_metadata": self.metadata,
-                }
-            )
-            self._emit(child_spans)
+        return _TraceCM(self, name, trace_metadata, span_metadata)
 
-    @contextmanager
     def _span(
         self,
         name: str,
-        parent: tuple[TraceId, Metadata, SpanId, list[Span]] | None = None,
-        **kwargs: str | int,
-    ) -> Iterator[dict[str, str | int]]:
-        """Start a new span, if there is a trace active."""
-        parent = parent or self._active_trace_and_span.get()
-        span_metadata: Metadata = kwargs
-        if parent is None:
-            yield span_metadata
-            return
+        parent: tuple[TraceId, Metadata, SpanId, list[Span]] | None,
+        span_metadata: Metadata,
+    ) -> _SpanCM:
+        """Start a new span, if there is a trace active.
 
-        trace_id, trace_metadata, parent_span_id, children = parent
-        start = time()
-        duration_start = perf_counter()
-        span_id = self._span_id_factory()
-        token = self._active_trace_and_span.set(
-            (trace_id, trace_metadata, span_id, children)
-        )
-        try:
-            yield span_metadata
-        except BaseException as exc:
-            span_metadata["error"] = repr(exc)
-            raise
-        finally:
-            self._active_trace_and_span.reset(token)
-            duration = perf_counter() - duration_start
-            children.append(
-                {
-                    "name": name,
-                    "time": start,
-                    "duration_ms": duration * 1000,
-                    "trace.trace_id": trace_id,
-                    "trace.span_id": span_id,
-                    "trace.parent_id": parent_span_id,
-                    "metadata": span_metadata,
-                    "trace_metadata": trace_metadata,
-                    "tracer_metadata": self.metadata,
-                }
-            )
+        Like in `_trace`, the span metadata dictionary is used as-is.
+        """
+        return _SpanCM(self, name, parent, span_metadata)
 
     def _emit(self, spans: list[Span]) -> None:
         """When a unit of work is finished, notify all receivers."""
@@ -168,76 +282,73 @@ class TracerBase:
 class Tracer(TracerBase):
     """A tracer for generating traces to be sent to a tracing service."""
 
-    @contextmanager
     def trace(
         self, name: str, trace_metadata: Metadata = {}, /, **kwargs: str | int
-    ) -> Iterator[dict[str, str | int]]:
+    ) -> _TraceCM:
         """Start a trace and a span, trace_chance permitting.
 
         Return a dictionary that can be used to add metadata.
         """
-        with self._trace(name, trace_metadata, **kwargs) as md:
-            yield md
+        return self._trace(name, trace_metadata, kwargs)
 
-    @contextmanager
     def span(
         self,
         name: str,
         parent: tuple[TraceId, Metadata, SpanId, list[Span]] | None = None,
         **kwargs: str | int,
-    ) -> Iterator[Metadata]:
+    ) -> _SpanCM:
         """Start a new span, if there is a trace active."""
-        with self._span(name, parent, **kwargs) as md:
-            yield md
+        return self._span(name, parent, kwargs)
 
     @contextmanager
     def span_from_dict(
         self, name: str, parent_dict: Mapping[str, str], **kwargs: str
     ) -> Iterator[Metadata]:
         """Start a child span, if possible."""
-        if "_trace" not in parent_dict:
+        if "_trace_id" not in parent_dict:
             yield {}
             return
-        trace_id, parent_id = parent_dict["_trace"].split(",")
         children: list[Span] = []
+        parent_id = parent_dict["_span_id"]
         try:
             with self.span(
-                name, (trace_id, {}, parent_id, children), **kwargs
+                name, (parent_dict["_trace_id"], {}, parent_id, children), **kwargs
             ) as span_metadata:
                 yield span_metadata
         finally:
             self._emit(children)
 
     def span_to_dict(self) -> dict[str, str]:
+        """Describe the active span, for `span_from_dict` elsewhere."""
         parent = self._active_trace_and_span.get()
-        return {} if parent is None else {"_trace": f"{parent[0]},{parent[1]}"}
+        return {} if parent is None else {"_trace_id": parent[0], "_span_id": parent[2]}
 
 
 def print_trace(spans: list[Span]) -> None:
     """Format a trace with Rich and print it out in the terminal."""
-
-    start = min(s["time"] for s in spans)
-    end = max(s["time"] + (s["duration_ms"] / 1000) for s in spans)
-
-    trace_span_ids = {s["trace.span_id"] for s in spans}
-
-    root_span = [
-        s
-        for s in spans
-        if ("trace.parent_id" not in s or s["trace.parent_id"] not in trace_span_ids)
-    ][0]
-    tree = Tree(t := Text(root_span["name"], style="bold white"))
+    # Rich is slow to import, so only pay for it when printing.
+    from rich import print as rich_print
+    from rich.columns import Columns
+    from rich.console import Group
+    from rich.text import Text
+    from rich.tree import Tree
+
+    start = min(s.time_ns for s in spans)
+    end = max(s.time_ns + s.duration_ns for s in spans)
+
+    root_span = _root_span(spans)
+    tree = Tree(t := Text(root_span.name, style="bold white"))
     t.set_length(30)
     data = _process_children(root_span, spans, start, end, tree)
 
     width = 120
     lines = []
-    durations = []  # In seconds
+    durations = []  # In nanoseconds
     metadata_strings = []
-    for _, start, stop, dur, metadata in data:
-        prefix = int(start * width) * " "
-        body = int((stop - start) * width) * "━"
-        suffix = int((1.0 - stop) * width) * " "
+    for _, _, start_pct, stop_pct, dur, metadata in data:
+        prefix = int(start_pct * width) * " "
+        body = int((stop_pct - start_pct) * width) * "━"
+        suffix = int((1.0 - stop_pct) * width) * " "
         line = Text(prefix + body + suffix)
         line.set_length(width)
         lines.append(line)
@@ -250,31 +361,88 @@ def print_trace(spans: list[Span]) -> None:
         [
             tree,
             Group(f"[bold sea_green2]{lines[0]}[/]", *[line for line in lines[1:]]),
-            Group(*[f"[dim]{dur * 1000:4.0f} [italic]ms[/][/]" for dur in durations]),
+            Group(
+                *[f"[dim]{dur / 1_000_000:4.0f} [italic]ms[/][/]" for dur in durations]
+            ),
             Group(*metadata_strings),
         ]
     )
     rich_print(g)
 
 
+def print_trace_fast(spans: list[Span]) -> None:
+    """Format a trace with plain ANSI escapes and write it to stdout.
+
+    A cheaper alternative to `print_trace`, for large traces and
+    non-interactive output.
+    """
+    start = min(s.time_ns for s in spans)
+    end = max(s.time_ns + s.duration_ns for s in spans)
+    data = _process_children(_root_span(spans), spans, start, end)
+
+    width = 120
+    out = []
+    for ix, (name, depth, start_pct, stop_pct, dur, metadata) in enumerate(data):
+        label = f"{'  ' * depth}{name}"[:30]
+        prefix = int(start_pct * width) * " "
+        body = int((stop_pct - start_pct) * width) * "━"
+        suffix = (width - len(prefix) - len(body)) * " "
+        style = "\x1b[1;32m" if ix == 0 else ""
+        md = " ".join(f"{k}=\x1b[35m{v}\x1b[0m" for k, v in metadata.items())
+        out.append(
+            f"{label:<30} {style}{prefix}{body}\x1b[0m{suffix} "
+            f"\x1b[2m{dur / 1_000_000:4.0f} \x1b[3mms\x1b[0m {md}\n"
+        )
+    sys.stdout.write("".join(out))
+
+
+def _root_span(spans: list[Span]) -> Span:
+    trace_span_ids = {s.span_id for s in spans}
+    return [
+        s for s in spans if (s.parent_id is None or s.parent_id not in trace_span_ids)
+    ][0]
+
+
 def _process_children(
-    parent: Span, spans: list[Span], start: float, end: float, tree: Tree
-) -> list[tuple[str, Instant, Instant, float, dict[str, str | int]]]:
+    root: Span,
+    spans: list[Span],
+    start: InstantNS,
+    end: InstantNS,
+    tree: Tree | None = None,
+) -> list[tuple[str, int, float, float, DurationNS, dict[str, str | int]]]:
+    """Flatten the span tree under `root` in depth-first order.
+
+    If a Rich tree is given, the span names are added to it too.
+    """
+    by_parent: defaultdict[SpanId | None, list[Span]] = defaultdict(list)
+    for span in spans:
+        by_parent[span.parent_id].append(span)
+
     total_duration = end - start
-    span_duration = parent["duration_ms"] / 1000
-    start_pct = (parent["time"] - start) / total_duration
-    res = [
-        (
-            parent["name"],
-            start_pct,
-            start_pct + (span_duration / total_duration),
-            span_duration,
-            parent["metadata"],
+    res = []
+    stack: list[tuple[Span, Tree | None, int]] = [(root, tree, 0)]
+    while stack:
+        span, span_tree, depth = stack.pop()
+        span_duration = span.duration_ns
+        start_pct = (span.time_ns - start) / total_duration
+        res.append(
+            (
+                span.name,
+                depth,
+                start_pct,
+                start_pct + (span_duration / total_duration),
+                span_duration,
+                span.metadata,
+            )
         )
-    ]
-    children = [s for s in spans if s.get("trace.parent_id") == parent["trace.span_id"]]
-    for child in children:
-        child_tree = tree.add(child["name"])
-        child_data = _process_children(child, spans, start, end, child_tree)
-        res.extend(child_data)
+        # Rich trees need their children added in order, the stack reversed.
+        children = [
+            (
+                child,
+                span_tree.add(child.name) if span_tree is not None else None,
+                depth + 1,
+            )
+            for child in by_parent.get(span.span_id, ())
+        ]
+        stack.extend(reversed(children))
     return res
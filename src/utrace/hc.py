@@ -1,35 +1,40 @@
 """Honeycomb utilities."""
 
 from asyncio import sleep
-from typing import Final, NoReturn
+from collections import deque
+from typing import TYPE_CHECKING, Final, NoReturn
 
-from aiohttp import ClientSession
 from orjson import dumps
 
 from . import Span, Tracer
 
+if TYPE_CHECKING:
+    from aiohttp import ClientSession
+
 HONEYCOMB_URL: Final = "https://api.honeycomb.io"
 
 
 async def send_to_honeycomb(
-    tracer: Tracer, http_client: ClientSession, api_key: str, dataset: str
+    tracer: Tracer, http_client: "ClientSession", api_key: str, dataset: str
 ) -> NoReturn:
     """Continually send traces to Honeycomb, until cancelled."""
     url = f"{HONEYCOMB_URL}/1/batch/{dataset}"
-    buffer: list[Span] = []
-
-    def add_to_buffer(spans: list[Span]) -> None:
-        if len(buffer) < 1000:
-            buffer.extend(spans)
+    # When full, the oldest spans are dropped.
+    buffer: deque[Span] = deque(maxlen=1000)
 
-    tracer.receivers.append(add_to_buffer)
+    tracer.receivers.append(buffer.extend)
 
     while True:
         while buffer:
-            buf = buffer
-            buffer = []
+            # Receivers may run in other threads, so drain without a gap.
+            buf = [buffer.popleft() for _ in range(len(buffer))]
             # HC expects a string value under "time"
-            payload = dumps([{"data": e, "time": str(e.pop("time"))} for e in buf])  # type: ignore
+            payload = dumps(
+                [
+                    {"data": e, "time": str(e.pop("time"))}
+                    for e in (span.as_dict() for span in buf)
+                ]
+            )
             resp = await http_client.post(
                 url, data=payload, headers={"X-Honeycomb-Team": api_key}
             )
@@ -1,47 +1,67 @@
-from datetime import datetime
+import sys
+from functools import lru_cache
+from time import localtime, strftime
 
 from . import Span
 
 
+@lru_cache(maxsize=64)
+def _second_prefix(secs: int) -> str:
+    return strftime("%Y-%m-%dT%H:%M:%S.", localtime(secs))
+
+
+def _isoformat(ts_ns: int) -> str:
+    """Format a nanosecond timestamp as a local ISO datetime, with microseconds.
+
+    Spans in a trace tend to share seconds, so the formatted seconds are cached.
+    """
+    secs, ns = divmod(ts_ns, 1_000_000_000)
+    return f"{_second_prefix(secs)}{ns // 1000:06d}"
+
+
 def encode_trace(spans: list[Span]) -> None:
     """Encode a trace for logs and eventual storage in OpenSearch."""
-    from orjson import dumps
+    from orjson import OPT_APPEND_NEWLINE, dumps
 
     last_span = spans[-1]
-    if "trace.parent_id" not in last_span:
+    if last_span.parent_id is None:
         # We only send the Trace Group metadata if we're ending
         # the trace here.
         # If it was started somewhere else, it will be set there.
-        tg = {
-            "traceGroup": last_span["name"],
+        tg: dict[str, object] = {
+            "traceGroup": last_span.name,
             "traceGroupFields": {
-                "endTime": datetime.fromtimestamp(
-                    last_span["time"] + (last_span["duration_ms"] / 1000)
-                ).isoformat(timespec="microseconds"),
-                "durationInNanos": int(last_span["duration_ms"] * 1_000_000),
+                "endTime": _isoformat(last_span.time_ns + last_span.duration_ns),
+                "durationInNanos": last_span.duration_ns,
             },
         }
     else:
         tg = {}
 
+    out = bytearray()
     for span in spans:
-        span_dict = {
+        span_dict: dict[str, object] = {
             "logger": "trace",
-            "traceId": span["trace.trace_id"],
-            "spanId": span["trace.span_id"],
-            "name": span["name"],
-            "startTime": datetime.fromtimestamp(span["time"]).isoformat(
-                timespec="microseconds"
-            ),
-            "endTime": (
-                datetime.fromtimestamp(
-                    span["time"] + (span["duration_ms"] / 1000)
-                ).isoformat(timespec="microseconds")
-            ),
-            "serviceName": span["tracer_metadata"]["service.name"],
-            "durationInNanos": int(span["duration_ms"] * 1_000_000),
-            "parentSpanId": span.get("trace.parent_id", ""),
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "startTime": _isoformat(span.time_ns),
+            "endTime": _isoformat(span.time_ns + span.duration_ns),
+            "serviceName": span.tracer_metadata["service.name"],
+            "durationInNanos": span.duration_ns,
+            "parentSpanId": span.parent_id or "",
         }
+        span_dict.update(span.metadata)
+        if tg:
+            span_dict.update(tg)
+        out += dumps(span_dict, option=OPT_APPEND_NEWLINE)
 
-        metadata = span["metadata"]
-        print(dumps(span_dict | metadata | tg).decode(), flush=True)
+    # One write for the whole trace, after anything pending in the text layer.
+    stdout = sys.stdout
+    stdout.flush()
+    # Replaced streams (like `io.StringIO`) might not have a binary layer.
+    if (buffer := getattr(stdout, "buffer", None)) is not None:
+        buffer.write(out)
+        buffer.flush()
+    else:
+        stdout.write(out.decode())
@@ -1,10 +1,17 @@
-from asyncio import sleep
-from contextlib import contextmanager
+import os
+from asyncio import Event, get_running_loop, to_thread, wait_for
+from collections import deque
+from contextlib import AbstractContextManager, nullcontext, suppress
 from functools import wraps
+from gzip import compress
 from inspect import iscoroutinefunction
-from itertools import chain
+from itertools import count
+from logging import getLogger
 from os import urandom
+from secrets import randbits
+from threading import get_ident
 from typing import (
+    TYPE_CHECKING,
     Callable,
     Final,
     Iterator,
@@ -15,20 +22,67 @@ from typing import (
     TypeVar,
 )
 
-from aiohttp import ClientSession
-from attrs import define
+from attrs import define, field
 from orjson import dumps
 
 from . import Metadata, SpanId, TraceId, TracerBase
 from . import Span as USpan
 
+if TYPE_CHECKING:
+    from aiohttp import ClientSession
+
+logger = getLogger(__name__)
+
+
+# Trace IDs are carved out of a pool of OS randomness, so a syscall only
+# happens every 256 trace IDs. The pool is an iterator of finished IDs;
+# taking from it is atomic, so no lock is needed across threads.
+_trace_ids: Iterator[str] = iter(())
+
+
+def _new_trace_ids() -> Iterator[str]:
+    pool = urandom(4096).hex()
+    return iter([pool[ix : ix + 32] for ix in range(0, len(pool), 32)])
+
 
 def trace_id_factory() -> str:
-    return urandom(16).hex()
+    global _trace_ids
+    if (trace_id := next(_trace_ids, None)) is None:
+        _trace_ids = _new_trace_ids()
+        trace_id = next(_trace_ids)
+    return trace_id
+
+
+# Span IDs only need to be unique within a trace, so instead of hitting
+# the OS for randomness, we XOR a counter with a random per-process seed.
+_span_id_seed = randbits(64)
+_span_id_cnt = count(1).__next__
+
+
+def _reset_after_fork() -> None:
+    """Forked children must not reuse their parent's IDs."""
+    global _trace_ids, _span_id_seed, _span_id_cnt
+    _trace_ids = iter(())
+    _span_id_seed = randbits(64)
+    _span_id_cnt = count(1).__next__
+
+
+# Not available on Windows, where there's no forking.
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
 
 
 def span_id_factory() -> str:
-    return urandom(8).hex()
+    return (_span_id_seed ^ _span_id_cnt()).to_bytes(8).hex()
+
+
+_KIND_TO_OTEL: Final = {
+    "internal": 1,
+    "server": 2,
+    "client": 3,
+    "producer": 4,
+    "consumer": 5,
+}
 
 
 AnyCallable = TypeVar("AnyCallable", bound=Callable)
@@ -36,12 +90,30 @@ AnyCallable = TypeVar("AnyCallable", bound=Callable)
 
 @define
 class Tracer(TracerBase):
-    """An OTel-specific tracer."""
+    """An OTel-specific tracer.
 
+    Args:
+        trace_self: Whether `send_to_otel` should trace its own exports.
+    """
+
+    trace_self: bool = False
     _trace_id_factory: Callable[[], TraceId] = trace_id_factory
     _span_id_factory: Callable[[], SpanId] = span_id_factory
+    _resource_metadata: Metadata | None = field(init=False, default=None)
+    _resource_json: bytes = field(init=False, default=b"")
+
+    def _resource_attributes_json(self) -> bytes:
+        """The resource attributes, serialized.
+
+        These only change when the tracer metadata does, so they are cached
+        alongside a copy of the metadata they were computed from.
+        """
+        if self.metadata != self._resource_metadata:
+            # Payloads are encoded off the event loop, so work from a copy.
+            self._resource_metadata = metadata = self.metadata.copy()
+            self._resource_json = _metadata_to_attributes_json(metadata)
+        return self._resource_json
 
-    @contextmanager
     def trace(
         self,
         name: str,
@@ -52,7 +124,7 @@ class Tracer(TracerBase):
             "client", "server", "internal", "producer", "consumer"
         ] = "server",
         **kwargs: str | int,
-    ) -> Iterator[Metadata]:
+    ) -> AbstractContextManager[Metadata]:
         """Start a trace and a span, trace_chance permitting.
 
         Args:
@@ -62,10 +134,9 @@ class Tracer(TracerBase):
         Returns:
             A dictionary that can be used to add span metadata.
         """
-        with self._trace(name, trace_metadata, kind=kind, **kwargs) as md:
-            yield md
+        kwargs["kind"] = kind
+        return self._trace(name, trace_metadata, kwargs)
 
-    @contextmanager
     def span(
         self,
         name: str,
@@ -76,9 +147,9 @@ class Tracer(TracerBase):
             "client", "server", "internal", "producer", "consumer"
         ] = "server",
         **kwargs: str | int,
-    ) -> Iterator[Metadata]:
-        with self._span(name, parent, kind=kind, **kwargs) as md:
-            yield md
+    ) -> AbstractContextManager[Metadata]:
+        kwargs["kind"] = kind
+        return self._span(name, parent, kwargs)
 
     def spanning(self, name: str | None = None) -> Callable[[AnyCallable], AnyCallable]:
         """
@@ -111,6 +182,10 @@ class Tracer(TracerBase):
         return decorator
 
 
+# How many spans to convert before serializing them.
+_ENCODING_CHUNK: Final = 100
+
+
 class StringValue(TypedDict):
     stringValue: str
 
@@ -166,92 +241,154 @@ class Payload(TypedDict):
 
 
 async def send_to_otel(
-    tracer: Tracer, http_client: ClientSession, url: str
+    tracer: Tracer,
+    http_client: "ClientSession",
+    url: str,
+    flush_interval: float = 5.0,
+    flush_threshold: int = 200,
+    gzip: bool = True,
 ) -> NoReturn:
     """Continually send traces to an OTel receiver via HTTP, until cancelled.
 
     The OTel collector uses port 4318 by default, and the URL prefix of
     `/v1/traces`.
+
+    The HTTP client can be created using `make_otel_session`.
+
+    Args:
+        flush_interval: How long to wait between sends, in seconds.
+        flush_threshold: How many buffered spans trigger a send early.
+        gzip: Whether to compress payloads. The OTel collector accepts
+            gzipped payloads by default.
     """
-    buffer: list[USpan] = []
+    # When full, the oldest spans are dropped.
+    buffer: deque[USpan] = deque(maxlen=1000)
+    flush = Event()
+    loop = get_running_loop()
+    loop_thread = get_ident()
+
+    def receive(spans: list[USpan]) -> None:
+        buffer.extend(spans)
+        if len(buffer) >= flush_threshold:
+            # Traces can finish in other threads, and events aren't thread-safe.
+            if get_ident() == loop_thread:
+                flush.set()
+            else:
+                loop.call_soon_threadsafe(flush.set)
+
+    tracer.receivers.append(receive)
 
-    def add_to_buffer(spans: list[USpan]) -> None:
-        if len(buffer) < 1000:
-            buffer.extend(spans)
+    encode = _encode_gzipped_payload if gzip else _encode_payload
+    headers = {"content-type": "application/json"}
+    if gzip:
+        headers["content-encoding"] = "gzip"
 
-    tracer.receivers.append(add_to_buffer)
+    # When tracing ourselves, we wait for a minimum number of spans so we
+    # don't get ourselves into a infinite loop, since we generate a span
+    # each send.
+    min_spans = 1 if tracer.trace_self else 0
 
     while True:
-        # We wait for a minimum number of spans so we don't get ourselves
-        # into a infinite loop, since we generate a span each send.
-        while len(buffer) > 1:
-            buf = buffer
-            buffer = []
-            payload = dumps(_utrace_spans_to_otel(tracer, buf))
-            with tracer.trace("utrace.send", kind="client", num_spans=len(buf)):
-                resp = await http_client.post(
-                    url, data=payload, headers={"content-type": "application/json"}
-                )
-                print(await resp.read())
-                resp.raise_for_status()
-        await sleep(5)
-
-
-def _utrace_spans_to_otel(tracer: Tracer, spans: list[USpan]) -> Payload:
-    """Convert utrace spans into OTel spans."""
+        while len(buffer) > min_spans:
+            # Receivers may run in other threads, so drain without a gap.
+            buf = [buffer.popleft() for _ in range(len(buffer))]
+            # Encoding a large batch takes a while, so keep it off the loop.
+            payload = await to_thread(encode, tracer, buf)
+            with (
+                tracer.trace("utrace.send", kind="client", num_spans=len(buf))
+                if tracer.trace_self
+                else nullcontext()
+            ):
+                resp = await http_client.post(url, data=payload, headers=headers)
+                if resp.status >= 400:
+                    # The batch is dropped; the collector may well recover.
+                    logger.warning(
+                        "OTel export failed: %s %s", resp.status, await resp.text()
+                    )
+                else:
+                    # Hand the connection back without reading the body.
+                    resp.release()
+        with suppress(TimeoutError):
+            await wait_for(flush.wait(), flush_interval)
+        flush.clear()
+
+
+def make_otel_session() -> "ClientSession":
+    """Create an HTTP client tuned for `send_to_otel`.
+
+    Connections to the collector are kept alive between flushes, and
+    responses are read with a large buffer. Call this from a coroutine.
+    """
+    from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+    return ClientSession(
+        connector=TCPConnector(limit_per_host=2, keepalive_timeout=75),
+        read_bufsize=4 * 1024 * 1024,
+        timeout=ClientTimeout(total=30),
+    )
+
+
+def _encode_payload(tracer: Tracer, spans: list[USpan]) -> bytearray:
+    """Encode spans into an OTel JSON payload.
+
+    Spans are converted and serialized in chunks, straight into the
+    envelope, so the whole converted batch never has to exist at once.
+    A chunk is serialized as a list, and its brackets dropped.
+    """
+    buf = bytearray(b'{"resourceSpans":[{"resource":{"attributes":')
+    buf += tracer._resource_attributes_json()
+    buf += b'},"scopeSpans":[{"scope":{},"spans":['
+    for ix in range(0, len(spans), _ENCODING_CHUNK):
+        if ix:
+            buf += b","
+        chunk = spans[ix : ix + _ENCODING_CHUNK]
+        buf += dumps([_utrace_span_to_otel(span) for span in chunk])[1:-1]
+    buf += b"]}]}]}"
+    return buf
+
+
+def _encode_gzipped_payload(tracer: Tracer, spans: list[USpan]) -> bytes:
+    """Encode spans into a gzipped OTel JSON payload.
+
+    The payloads are very repetitive, so even the fastest compression
+    level shrinks them several times over.
+    """
+    return compress(_encode_payload(tracer, spans), compresslevel=1)
+
+
+def _make_kv(k: str, v: str | int) -> KVPair:
     return {
-        "resourceSpans": [
-            {
-                "resource": {
-                    "attributes": [
-                        {
-                            "key": k,
-                            "value": {"stringValue": v}
-                            if isinstance(v, str)
-                            else {"intValue": v},  # type: ignore
-                        }
-                        for k, v in tracer.metadata.items()
-                    ]
-                },
-                "scopeSpans": [
-                    {
-                        "scope": {},
-                        "spans": [_utrace_span_to_otel(span) for span in spans],
-                    }
-                ],
-            }
-        ]
+        "key": k,
+        "value": {"stringValue": v} if isinstance(v, str) else {"intValue": v},
     }
 
 
-_KIND_TO_OTEL: Final = {
-    "internal": 1,
-    "server": 2,
-    "client": 3,
-    "producer": 4,
-    "consumer": 5,
-}
+def _metadata_to_attributes_json(metadata: Metadata) -> bytes:
+    return dumps([_make_kv(k, v) for k, v in metadata.items()])
 
 
 def _utrace_span_to_otel(span: USpan) -> Span:
+    # This is `_make_kv` inlined, since it's called for every attribute.
+    metadata = span.metadata
+    attributes: list[KVPair] = [
+        {
+            "key": k,
+            "value": {"stringValue": v} if isinstance(v, str) else {"intValue": v},
+        }
+        for md in (span.trace_metadata, metadata)
+        for k, v in md.items()
+        if k != "kind"
+    ]
+    start_ns = span.time_ns
     res: Span = {
-        "traceId": span["trace.trace_id"],
-        "spanId": span["trace.span_id"],
-        "startTimeUnixNano": str(int(span["time"] * 1_000_000_000)),
-        "endTimeUnixNano": str(
-            int(span["time"] * 1_000_000_000 + span["duration_ms"] * 1_000_000)
-        ),
-        "kind": _KIND_TO_OTEL[str(span["metadata"]["kind"])],
-        "name": span["name"],
-        "attributes": [
-            {
-                "key": k,
-                "value": {"stringValue": v} if isinstance(v, str) else {"intValue": v},  # type: ignore
-            }
-            for k, v in chain(span["trace_metadata"].items(), span["metadata"].items())
-            if k != "kind"
-        ],
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(start_ns + span.duration_ns),
+        "kind": _KIND_TO_OTEL[metadata["kind"]],  # type: ignore
+        "name": span.name,
+        "attributes": attributes,
     }
-    if "trace.parent_id" in span:
-        res["parentSpanId"] = span["trace.parent_id"]
+    if span.parent_id is not None:
+        res["parentSpanId"] = span.parent_id
     return res
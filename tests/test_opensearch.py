@@ -0,0 +1,49 @@
+from datetime import datetime
+from io import StringIO
+from time import time_ns
+
+import pytest
+from orjson import loads
+
+from utrace import Span, Tracer
+from utrace.opensearch import _isoformat, encode_trace
+
+
+def test_isoformat() -> None:
+    """`_isoformat` matches `datetime.isoformat`."""
+    now = time_ns()
+    for ts in [0, 999_999_999, 1_700_000_000_123_456_789, now, now + 500_000_000]:
+        secs, ns = divmod(ts, 1_000_000_000)
+        expected = datetime.fromtimestamp(secs).replace(microsecond=ns // 1000)
+        assert _isoformat(ts) == expected.isoformat(timespec="microseconds")
+
+
+def test_encode_trace(capsysbinary: pytest.CaptureFixture[bytes]) -> None:
+    """Every span is written out as a line of JSON."""
+    all_spans: list[Span] = []
+    tracer = Tracer("service", receivers=[all_spans.extend])
+
+    with tracer.trace("trace"), tracer.span("span", key="value"):
+        pass
+
+    encode_trace(all_spans)
+
+    lines = [loads(line) for line in capsysbinary.readouterr().out.splitlines()]
+    assert [line["name"] for line in lines] == ["span", "trace"]
+    assert lines[0]["key"] == "value"
+    assert lines[0]["parentSpanId"] == lines[1]["spanId"]
+    assert lines[1]["traceGroup"] == "trace"
+
+
+def test_encode_trace_text_stdout(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Text-only replacement stdouts are supported."""
+    all_spans: list[Span] = []
+    tracer = Tracer("service", receivers=[all_spans.extend])
+    with tracer.trace("trace"):
+        pass
+    stdout = StringIO()
+    monkeypatch.setattr("sys.stdout", stdout)
+
+    encode_trace(all_spans)
+
+    assert loads(stdout.getvalue())["name"] == "trace"
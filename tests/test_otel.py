@@ -1,5 +1,24 @@
+import time
+from asyncio import CancelledError, Event, create_task, sleep, wait_for
+from collections.abc import Callable
+from contextlib import suppress
+from threading import Thread
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from orjson import loads
+
 from utrace import Span
-from utrace.otel import Tracer
+from utrace.otel import (
+    Payload,
+    Tracer,
+    _encode_payload,
+    make_otel_session,
+    send_to_otel,
+    span_id_factory,
+    trace_id_factory,
+)
 
 
 async def test_spanning() -> None:
@@ -32,22 +51,240 @@ async def test_spanning() -> None:
         assert my_class.test() == 1
 
     assert len(all_spans) == 2
-    assert all_spans[0]["name"] == MyClass.test.__name__
+    assert all_spans[0].name == MyClass.test.__name__
 
     all_spans.clear()
     with tracer.trace("trace"):
         assert my_class.test2() == 2
     assert len(all_spans) == 2
-    assert all_spans[0]["name"] == "test2span"
+    assert all_spans[0].name == "test2span"
 
     all_spans.clear()
     with tracer.trace("trace"):
         assert await my_class.test3() == 3
     assert len(all_spans) == 2
-    assert all_spans[0]["name"] == "test3"
+    assert all_spans[0].name == "test3"
 
     all_spans.clear()
     with tracer.trace("trace"):
         assert await my_class.test4() == 4
     assert len(all_spans) == 2
-    assert all_spans[0]["name"] == "test4span"
+    assert all_spans[0].name == "test4span"
+
+
+def test_resource_attributes() -> None:
+    """Resource attributes follow the tracer metadata."""
+    tracer = Tracer("service")
+
+    payload: Payload = loads(_encode_payload(tracer, []))
+    assert payload["resourceSpans"][0]["resource"]["attributes"] == [
+        {"key": "service.name", "value": {"stringValue": "service"}}
+    ]
+
+    tracer.metadata["service.instance"] = 1
+    payload = loads(_encode_payload(tracer, []))
+    assert payload["resourceSpans"][0]["resource"]["attributes"] == [
+        {"key": "service.name", "value": {"stringValue": "service"}},
+        {"key": "service.instance", "value": {"intValue": 1}},
+    ]
+
+
+def test_trace_ids() -> None:
+    """Trace IDs are unique 32-digit hex strings, across pool refills."""
+    trace_ids = [trace_id_factory() for _ in range(1000)]
+
+    assert len(set(trace_ids)) == len(trace_ids)
+    assert all(len(trace_id) == 32 for trace_id in trace_ids)
+    assert all(int(trace_id, 16) >= 0 for trace_id in trace_ids)
+
+
+def test_span_ids() -> None:
+    """Span IDs are unique 16-digit hex strings."""
+    span_ids = [span_id_factory() for _ in range(1000)]
+
+    assert len(set(span_ids)) == len(span_ids)
+    assert all(len(span_id) == 16 for span_id in span_ids)
+    assert all(int(span_id, 16) >= 0 for span_id in span_ids)
+
+
+def test_span_kind() -> None:
+    """Span kinds are exported as OTel enum values, not attributes."""
+    all_spans: list[Span] = []
+    tracer = Tracer("service", receivers=[all_spans.extend])
+
+    with tracer.trace("trace", key="value"), tracer.span("span", kind="client"):
+        pass
+
+    payload: Payload = loads(_encode_payload(tracer, all_spans))
+    otel_spans = payload["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [s["kind"] for s in otel_spans] == [3, 2]
+    assert [s.metadata["kind"] for s in all_spans] == ["client", "server"]
+    assert otel_spans[0]["attributes"] == []
+    assert otel_spans[1]["attributes"] == [
+        {"key": "key", "value": {"stringValue": "value"}}
+    ]
+
+
+def test_encode_payload_chunks() -> None:
+    """Payloads spanning several encoding chunks are valid."""
+    all_spans: list[Span] = []
+    tracer = Tracer("service", receivers=[all_spans.extend])
+
+    with tracer.trace("trace"):
+        for ix in range(250):
+            with tracer.span("span", ix=ix):
+                pass
+
+    payload: Payload = loads(_encode_payload(tracer, all_spans))
+    otel_spans = payload["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [s["spanId"] for s in otel_spans] == [s.span_id for s in all_spans]
+
+
+async def test_make_otel_session() -> None:
+    """`make_otel_session` creates a usable session."""
+    async with make_otel_session() as session:
+        assert not session.closed
+
+
+async def _export(
+    tracer: Tracer,
+    batches: int,
+    emit: Callable[[], None],
+    flush_interval: float = 0.01,
+    flush_threshold: int = 200,
+    gzip: bool = True,
+    statuses: list[int] | None = None,
+) -> list[Payload]:
+    """Run `send_to_otel` against a test server until `batches` arrive.
+
+    `emit` is called after the exporter starts and after every batch.
+    The server responds with `statuses` in order, and 200 afterwards.
+    """
+    received: list[Payload] = []
+    statuses = list(statuses or [])
+    batch_received = Event()
+
+    async def handler(request: web.Request) -> web.Response:
+        assert request.headers.get("content-encoding") == ("gzip" if gzip else None)
+        # aiohttp decompresses request bodies transparently.
+        received.append(loads(await request.read()))
+        batch_received.set()
+        return web.Response(status=statuses.pop(0) if statuses else 200)
+
+    app = web.Application()
+    app.router.add_post("/v1/traces", handler)
+
+    async def wait_for_batches() -> None:
+        while True:
+            await batch_received.wait()
+            batch_received.clear()
+            if len(received) >= batches:
+                return
+            emit()
+
+    async with TestServer(app) as server, make_otel_session() as session:
+        url = str(server.make_url("/v1/traces"))
+        task = create_task(
+            send_to_otel(tracer, session, url, flush_interval, flush_threshold, gzip)
+        )
+        await sleep(0)  # Let the exporter register its receiver.
+        emit()
+        try:
+            await wait_for(wait_for_batches(), timeout=5)
+        finally:
+            task.cancel()
+            with suppress(CancelledError):
+                await task
+
+    return received
+
+
+def _span_names(payload: Payload) -> list[str]:
+    return [s["name"] for s in payload["resourceSpans"][0]["scopeSpans"][0]["spans"]]
+
+
+async def test_send_to_otel() -> None:
+    """Spans are exported, without self-tracing by default."""
+    tracer = Tracer("service", receivers=[])
+
+    def emit() -> None:
+        with tracer.trace("trace"):
+            pass
+
+    received = await _export(tracer, 2, emit)
+
+    assert [_span_names(payload) for payload in received] == [["trace"], ["trace"]]
+
+
+async def test_send_to_otel_trace_self() -> None:
+    """With `trace_self`, exports show up in later batches."""
+    tracer = Tracer("service", receivers=[], trace_self=True)
+
+    def emit() -> None:
+        # Self-tracing exports wait for at least two spans.
+        for _ in range(2):
+            with tracer.trace("trace"):
+                pass
+
+    received = await _export(tracer, 2, emit)
+
+    assert _span_names(received[0]) == ["trace", "trace"]
+    assert "utrace.send" in _span_names(received[1])
+
+
+async def test_send_to_otel_threshold() -> None:
+    """Enough buffered spans are sent without waiting for the interval."""
+    tracer = Tracer("service", receivers=[])
+
+    def emit() -> None:
+        with tracer.trace("trace"), tracer.span("span"):
+            pass
+
+    received = await _export(tracer, 1, emit, flush_interval=60, flush_threshold=2)
+
+    assert _span_names(received[0]) == ["span", "trace"]
+
+
+async def test_send_to_otel_uncompressed() -> None:
+    """Compression can be turned off."""
+    tracer = Tracer("service", receivers=[])
+
+    def emit() -> None:
+        with tracer.trace("trace"):
+            pass
+
+    received = await _export(tracer, 1, emit, gzip=False)
+
+    assert _span_names(received[0]) == ["trace"]
+
+
+async def test_send_to_otel_failure(caplog: pytest.LogCaptureFixture) -> None:
+    """Failed exports are logged, and the exporter keeps going."""
+    tracer = Tracer("service", receivers=[])
+
+    def emit() -> None:
+        with tracer.trace("trace"):
+            pass
+
+    received = await _export(tracer, 2, emit, statuses=[500])
+
+    assert [_span_names(payload) for payload in received] == [["trace"], ["trace"]]
+    assert "OTel export failed: 500" in caplog.text
+
+
+async def test_send_to_otel_threshold_thread() -> None:
+    """Spans from other threads trigger early sends too."""
+    tracer = Tracer("service", receivers=[])
+
+    def trace() -> None:
+        # Give the event loop time to go idle.
+        time.sleep(0.1)
+        with tracer.trace("trace"):
+            pass
+
+    def emit() -> None:
+        Thread(target=trace).start()
+
+    received = await _export(tracer, 1, emit, flush_interval=60, flush_threshold=1)
+
+    assert _span_names(received[0]) == ["trace"]
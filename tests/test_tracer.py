@@ -1,4 +1,8 @@
-from utrace import Span, Tracer
+from asyncio import gather, sleep
+
+import pytest
+
+from utrace import Span, Tracer, print_trace_fast
 
 
 def test_trace_and_span() -> None:
@@ -10,10 +14,121 @@ def test_trace_and_span() -> None:
             pass
 
     assert len(all_spans) == 2
-    assert all_spans[0]["name"] == "span"
-    assert all_spans[0]["metadata"] == {"span_metadata": "span test"}
-    assert all_spans[0]["trace.parent_id"] == all_spans[1]["trace.span_id"]
-    assert all_spans[0]["trace.trace_id"] == all_spans[1]["trace.trace_id"]
+    assert all_spans[0].name == "span"
+    assert all_spans[0].metadata == {"span_metadata": "span test"}
+    assert all_spans[0].parent_id == all_spans[1].span_id
+    assert all_spans[0].trace_id == all_spans[1].trace_id
+
+    assert all_spans[1].name == "trace"
+    assert all_spans[1].trace_metadata == {"trace_metadata": "test"}
+
+
+def test_untraced() -> None:
+    """Sampled-out traces and spans outside traces are no-ops."""
+    all_spans: list[Span] = []
+    tracer = Tracer("service", receivers=[all_spans.extend], trace_chance=0.0)
+
+    with tracer.trace("trace") as md, tracer.span("span") as span_md:
+        md["key"] = "value"
+        span_md["key"] = "value"
+
+    with tracer.span("span", key="value") as span_md:
+        assert span_md == {"key": "value"}
+
+    assert all_spans == []
+
+
+def test_span_entered_later() -> None:
+    """Spans find their parent when entered, not when created."""
+    all_spans: list[Span] = []
+    tracer = Tracer("service", receivers=[all_spans.extend])
+
+    cm = tracer.span("span")
+    with tracer.trace("trace"), cm:
+        pass
+
+    assert [s.name for s in all_spans] == ["span", "trace"]
+    assert all_spans[0].parent_id == all_spans[1].span_id
+
+
+def test_decorators() -> None:
+    """Traces and spans can decorate functions, recording every call."""
+    all_spans: list[Span] = []
+    tracer = Tracer("service", receivers=[all_spans.extend])
+
+    @tracer.span("span", key="value")
+    def inner() -> None:
+        pass
+
+    @tracer.trace("trace")
+    def outer() -> None:
+        inner()
+        inner()
+
+    outer()
+    outer()
+
+    assert [s.name for s in all_spans] == ["span", "span", "trace"] * 2
+    assert len({s.span_id for s in all_spans}) == 6
+    assert all_spans[0].metadata is not all_spans[1].metadata
+    assert all_spans[0].metadata == {"key": "value"}
+
+
+async def test_concurrent_spans() -> None:
+    """Spans in concurrent tasks get the correct parents."""
+    all_spans: list[Span] = []
+    tracer = Tracer("service", receivers=[all_spans.extend])
+
+    async def child(name: str) -> None:
+        with tracer.span(name):
+            await sleep(0)
+            with tracer.span(f"{name}.inner"):
+                await sleep(0)
+
+    with tracer.trace("trace"):
+        await gather(child("a"), child("b"))
+
+    by_name = {span.name: span for span in all_spans}
+    assert by_name["a"].parent_id == by_name["trace"].span_id
+    assert by_name["b"].parent_id == by_name["trace"].span_id
+    assert by_name["a.inner"].parent_id == by_name["a"].span_id
+    assert by_name["b.inner"].parent_id == by_name["b"].span_id
+
+
+def test_print_trace_fast(capsys: pytest.CaptureFixture[str]) -> None:
+    """`print_trace_fast` writes a line per span, in tree order."""
+    all_spans: list[Span] = []
+    tracer = Tracer("service", receivers=[all_spans.extend])
+
+    with tracer.trace("trace"):
+        with tracer.span("span1", key="value"), tracer.span("span2"):
+            pass
+        with tracer.span("span3"):
+            pass
+
+    print_trace_fast(all_spans)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split()[0] for line in lines] == ["trace", "span1", "span2", "span3"]
+    assert lines[2].startswith("    span2")
+    assert "key=\x1b[35mvalue" in lines[1]
+
+
+def test_span_dict_roundtrip() -> None:
+    """Spans can be continued from `span_to_dict`."""
+    all_spans: list[Span] = []
+    tracer = Tracer("service", receivers=[all_spans.extend])
+
+    assert tracer.span_to_dict() == {}
+
+    with tracer.trace("trace"):
+        parent_dict = tracer.span_to_dict()
+
+    with tracer.span_from_dict("remote", parent_dict, key="value"):
+        pass
 
-    assert all_spans[1]["name"] == "trace"
-    assert all_spans[1]["trace_metadata"] == {"trace_metadata": "test"}  # type: ignore
+    trace, remote = all_spans
+    assert remote.name == "remote"
+    assert remote.trace_id == trace.trace_id
+    assert remote.parent_id == trace.span_id
+    assert remote.metadata == {"key": "value"}